@@ -5,51 +5,177 @@ Connects to 2GIS WebSocket, receives location data, and forwards it to Traccar A
 """
 
 import asyncio
+import atexit
+import copy
 import json
 import logging
+import queue
+import random
 import time
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack
 from datetime import datetime, timezone
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from typing import Dict, Any, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, Any, List, NamedTuple, Optional, Set, Tuple, Union
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
 
 import aiohttp
-import websockets
-from websockets.exceptions import ConnectionClosed, WebSocketException
-
-from config import (
-    TWOGIS_WS_URL, TRACCAR_BASE_URL, LOG_LEVEL, LOG_FILE,
-    WEBHOOK_URL, WEBHOOK_TOKEN, WEBHOOK_TABLE_NAME,
-    TWOGIS_REFRESH_TOKEN, TWOGIS_AUTH_REFRESH_URL, TWOGIS_TOKEN_FILE,
-)
-
-# Setup logging
+import orjson
+from yarl import URL
+
+try:
+    import uvloop
+except ImportError:  # Not available on Windows
+    uvloop = None
+
+if TYPE_CHECKING:
+    import httpx  # Optional dependency (requirements-http2.txt), imported at runtime only with TRACCAR_HTTP2
+
+from config import CONFIG
+
+# Setup logging: the event loop only enqueues records, a listener thread does the file/console I/O
+_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_log_handlers = [logging.FileHandler(CONFIG.log_file), logging.StreamHandler()]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_log_queue: queue.Queue = queue.Queue(-1)
+_log_listener = QueueListener(_log_queue, *_log_handlers, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+_queue_handler = QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # Full format is applied by the listener's handlers
 logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL.upper()),
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
+    level=getattr(logging, CONFIG.log_level.upper()),
+    handlers=[_queue_handler]
 )
 logger = logging.getLogger(__name__)
 
+# Outbound position pipeline: bounded buffer between the WebSocket reader and Traccar senders
+POSITION_QUEUE_SIZE = 512
+SEND_WORKER_COUNT = 8
+# Webhook sends allowed in flight at once; further messages skip the webhook until some finish
+WEBHOOK_MAX_IN_FLIGHT = 32
+# Seconds to wait at shutdown for queued positions (and webhook sends) to be delivered
+SHUTDOWN_DRAIN_TIMEOUT = 10.0
+
+# First reconnect delay in seconds; doubles per attempt up to CONFIG.reconnect_delay
+RECONNECT_INITIAL_DELAY = 1.0
+
+
+@lru_cache(maxsize=1024)
+def _iso_seconds(seconds: int) -> str:
+    """Format whole epoch seconds as a UTC ISO 8601 string (without fraction)"""
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+
+
+def _iso_from_ms(ms: int) -> str:
+    """Format epoch milliseconds as UTC ISO 8601 with millisecond precision, e.g. 2024-01-01T12:00:00.000Z"""
+    seconds, millis = divmod(int(ms), 1000)
+    return f"{_iso_seconds(seconds)}.{millis:03d}Z"
+
+
+_2GIS_FIRM_URL = "https://2gis.kz/almaty/firm/"
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Substring present in every friendState frame (as the "type" value), checked before parsing
+_FRIEND_STATE_MARKER = '"friendState"'
+_FRIEND_STATE_MARKER_BYTES = _FRIEND_STATE_MARKER.encode()
+
+
+def _build_extras(payload: Dict[str, Any], movement: Dict[str, Any], _firm_url: str = _2GIS_FIRM_URL) -> Dict[str, Any]:
+    """Build OsmAnd extras from 2GIS friendState fields not used in the main location structure"""
+    extras = {}
+
+    last_seen = payload.get("lastSeen")
+    if last_seen is not None:
+        extras["2gis_lastSeen"] = _iso_from_ms(last_seen)
+
+    # Flattened location place data (a malformed non-dict value only drops these extras, not the position)
+    location_place = payload.get("locationPlace")
+    if not isinstance(location_place, dict):
+        location_place = {}
+    place_object = location_place.get("object")
+    if not isinstance(place_object, dict):
+        place_object = {}
+    location_id = place_object.get("id")
+    if location_id is not None:
+        extras["2gis_locationId"] = location_id
+        extras["2gis_locationUrl"] = _firm_url + str(location_id)
+    region_id = place_object.get("regionId")
+    if region_id is not None:
+        extras["2gis_regionId"] = region_id
+    if "status" in location_place:
+        extras["2gis_locationStatus"] = location_place["status"]
+
+    stopped_at = movement.get("stoppedAt")
+    if stopped_at is not None:
+        extras["2gis_stoppedAt"] = _iso_from_ms(stopped_at)
+
+    return extras
+
+
+def _state_key(lat: float, lon: float, movement_status: Optional[str],
+               battery: Optional[float], is_charging: Optional[bool]) -> tuple:
+    """Key identifying a friend state for dedup; equal keys mean nothing Traccar cares about changed"""
+    return (round(lat, 6), round(lon, 6), movement_status, battery, is_charging)
+
+
+class Position(NamedTuple):
+    """A parsed 2GIS friend location, queued for Traccar (speed in m/s)"""
+    device_id: str
+    lat: float
+    lon: float
+    speed: Optional[float] = None
+    course: Optional[float] = None
+    accuracy: Optional[float] = None
+    battery: Optional[float] = None
+    is_charging: Optional[bool] = None
+    is_moving: Optional[bool] = None
+    movement_status: Optional[str] = None
+    extras: Optional[Dict[str, Any]] = None
+
 
 class TraccarClient:
     """Client for sending data to Traccar using OsmAnd protocol"""
     
-    def __init__(self, base_url: str):
-        self.base_url = base_url.rstrip('/')
-        self.session = None
-    
-    async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
-        return self
+    # OsmAnd JSON format skeleton; copied once per device, then only the mutable leaves are updated
+    _PAYLOAD_TEMPLATE = {
+        "location": {
+            "timestamp": None,
+            "coords": {
+                "latitude": 0,
+                "longitude": 0,
+                "accuracy": 0,
+                "speed": 0,
+                "heading": 0,
+                "altitude": 0  # 2GIS doesn't provide altitude
+            },
+            "is_moving": False,
+            "odometer": 0,  # 2GIS doesn't provide odometer
+            "event": "motionchange",  # Default event type
+            "battery": {
+                "level": 1,
+                "is_charging": False
+            },
+            "activity": {
+                "type": "still"
+            },
+            "extras": {}
+        },
+        "device_id": "",
+        "test": "Hello world"
+    }
     
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
+    def __init__(self, base_url: str, session: aiohttp.ClientSession,
+                 http2_client: Optional["httpx.AsyncClient"] = None):
+        self.base_url = base_url.rstrip('/')
+        # Parsed once so aiohttp does not re-parse the URL string on every POST
+        self.url = URL(self.base_url)
+        self.session = session
+        # Optional httpx.AsyncClient (TRACCAR_HTTP2); used instead of the aiohttp session when set
+        self.http2_client = http2_client
+        self._payload_by_device: Dict[str, Dict[str, Any]] = {}
     
     def _map_movement_to_activity(self, movement_status: Optional[str], is_moving: Optional[bool]) -> str:
         """Map 2GIS movement status to OsmAnd activity type"""
@@ -62,131 +188,106 @@ class TraccarClient:
         else:
             return "still"  # Default
     
-    async def send_position(self, device_id: str, lat: float, lon: float, 
-                          speed: Optional[float] = None, course: Optional[float] = None,
-                          accuracy: Optional[float] = None, battery: Optional[float] = None,
-                          is_charging: Optional[bool] = None, is_moving: Optional[bool] = None,
-                          movement_status: Optional[str] = None, extras: Optional[Dict[str, Any]] = None) -> bool:
+    def _payload_for(self, device_id: str) -> Dict[str, Any]:
+        """Get the reusable OsmAnd payload dict for a device, creating it from the template on first use"""
+        payload = self._payload_by_device.get(device_id)
+        if payload is None:
+            payload = copy.deepcopy(self._PAYLOAD_TEMPLATE)
+            payload["device_id"] = device_id
+            self._payload_by_device[device_id] = payload
+        return payload
+    
+    async def send_position(self, position: Position) -> bool:
         """Send position data to Traccar using OsmAnd POST protocol with JSON format"""
-        if not self.session:
-            logger.error("Traccar session not initialized")
-            return False
-        
-        # Convert speed from km/h to m/s (OsmAnd JSON format uses m/s)
-        speed_ms = None
-        if speed is not None:
-            speed_ms = speed / 3.6  # km/h to m/s conversion
-        
-        # Prepare OsmAnd JSON format payload
-        payload = {
-            "location": {
-                "timestamp": datetime.utcnow().isoformat() + "Z",
-                "coords": {
-                    "latitude": lat,
-                    "longitude": lon,
-                    "accuracy": accuracy if accuracy is not None else 0,
-                    "speed": speed_ms if speed_ms is not None else 0,
-                    "heading": course if course is not None else 0,
-                    "altitude": 0  # 2GIS doesn't provide altitude
-                },
-                "is_moving": is_moving if is_moving is not None else False,
-                "odometer": 0,  # 2GIS doesn't provide odometer
-                "event": "motionchange",  # Default event type
-                "battery": {
-                    "level": battery if battery is not None else 1,
-                    "is_charging": is_charging if is_charging is not None else False
-                },
-                "activity": {
-                    "type": self._map_movement_to_activity(movement_status, is_moving)
-                },
-                "extras": extras if extras is not None else {}
-            },
-            "device_id": device_id,
-            "test": "Hello world"
-        }
+        (device_id, lat, lon, speed, course, accuracy, battery,
+         is_charging, is_moving, movement_status, extras) = position
+        # Fill the device's OsmAnd payload. It is shared between sends for the same device,
+        # so it must be serialized below before the first await.
+        payload = self._payload_for(device_id)
+        location = payload["location"]
+        location["timestamp"] = _iso_from_ms(time.time() * 1000)
+        coords = location["coords"]
+        coords["latitude"] = lat
+        coords["longitude"] = lon
+        coords["accuracy"] = accuracy if accuracy is not None else 0
+        coords["speed"] = speed if speed is not None else 0  # m/s, as reported by 2GIS
+        coords["heading"] = course if course is not None else 0
+        location["is_moving"] = is_moving if is_moving is not None else False
+        location["battery"]["level"] = battery if battery is not None else 1
+        location["battery"]["is_charging"] = is_charging if is_charging is not None else False
+        location["activity"]["type"] = self._map_movement_to_activity(movement_status, is_moving)
+        location["extras"] = extras if extras is not None else {}
         
         try:
             # Log the request for debugging
-            logger.debug(f"Sending OsmAnd POST request to: {self.base_url}")
-            logger.debug(f"Payload: {json.dumps(payload, indent=2)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Sending OsmAnd POST request to: %s", self.base_url)
+                logger.debug("Payload: %s", orjson.dumps(payload).decode())
             
             # Send POST request to Traccar OsmAnd endpoint
-            async with self.session.post(
-                self.base_url,
-                json=payload,
-                headers={"Content-Type": "application/json"}
-            ) as response:
-                response_text = await response.text()
-                if response.status == 200:
-                    logger.info(f"Position sent successfully: {lat}, {lon}")
-                    return True
-                else:
-                    logger.error(f"Failed to send position: {response.status} - {response_text}")
-                    logger.error(f"Request URL: {response.url}")
-                    return False
+            body = orjson.dumps(payload)
+            if self.http2_client is not None:
+                response = await self.http2_client.post(self.base_url, content=body, headers=_JSON_HEADERS)
+                status, response_text, response_url = response.status_code, response.text, response.url
+            else:
+                async with self.session.post(self.url, data=body, headers=_JSON_HEADERS) as response:
+                    status, response_text, response_url = response.status, await response.text(), response.url
+            if status == 200:
+                logger.info("Position sent successfully: %s, %s", lat, lon)
+                return True
+            else:
+                logger.error("Failed to send position: %s - %s", status, response_text)
+                logger.error("Request URL: %s", response_url)
+                return False
                     
         except Exception as e:
-            logger.error(f"Error sending position to Traccar: {e}")
+            logger.error("Error sending position to Traccar: %s", e)
             return False
 
 
 class WebhookClient:
     """Client for sending data to n8n webhook endpoint"""
     
-    def __init__(self, webhook_url: str, webhook_token: str, table_name: str):
+    def __init__(self, webhook_url: str, webhook_token: str, table_name: str,
+                 session: aiohttp.ClientSession):
         self.webhook_url = webhook_url
+        self.url = URL(webhook_url)
         self.webhook_token = webhook_token
         self.table_name = table_name
-        self.session = None
-    
-    async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
-        return self
-    
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
+        self.session = session
+        self.headers = {
+            "Authorization": f"Bearer {webhook_token}",
+            **_JSON_HEADERS
+        }
     
     async def send_data(self, data: Dict[str, Any]) -> bool:
         """Send data to webhook endpoint"""
-        if not self.session:
-            logger.error("Webhook session not initialized")
-            return False
-        
-        if not self.webhook_url or not self.webhook_token:
-            logger.debug("Webhook not configured, skipping webhook send")
-            return True
-        
         # Prepare the payload - send raw 2GIS data directly
         payload = {
             "tableName": self.table_name,
             "data": data
         }
         
-        headers = {
-            "Authorization": f"Bearer {self.webhook_token}",
-            "Content-Type": "application/json"
-        }
-        
         try:
-            logger.debug(f"Sending webhook data to: {self.webhook_url}")
-            logger.debug(f"Payload: {payload}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Sending webhook data to: %s", self.webhook_url)
+                logger.debug("Payload: %s", orjson.dumps(payload).decode())
             
             async with self.session.post(
-                self.webhook_url,
-                json=payload,
-                headers=headers
+                self.url,
+                data=orjson.dumps(payload),
+                headers=self.headers
             ) as response:
                 response_text = await response.text()
                 if response.status == 200:
-                    logger.info(f"Data sent to webhook successfully")
+                    logger.info("Data sent to webhook successfully")
                     return True
                 else:
-                    logger.error(f"Failed to send data to webhook: {response.status} - {response_text}")
+                    logger.error("Failed to send data to webhook: %s - %s", response.status, response_text)
                     return False
                     
         except Exception as e:
-            logger.error(f"Error sending data to webhook: {e}")
+            logger.error("Error sending data to webhook: %s", e)
             return False
 
 
@@ -295,7 +396,7 @@ class TwoGisAuthClient:
                     self.access_token = a
                 return True
         except Exception as e:
-            logger.debug(f"Could not load tokens from file: {e}")
+            logger.debug("Could not load tokens from file: %s", e)
         return False
 
     def _save_tokens_to_file(self, refresh_token: str, access_token: Optional[str]):
@@ -313,9 +414,9 @@ class TwoGisAuthClient:
                     indent=2,
                 )
             )
-            logger.debug(f"Saved refreshed tokens to {self.token_file}")
+            logger.debug("Saved refreshed tokens to %s", self.token_file)
         except Exception as e:
-            logger.warning(f"Could not save tokens to file: {e}")
+            logger.warning("Could not save tokens to file: %s", e)
 
     def get_next_refresh_seconds(self) -> int:
         """Seconds to wait before next refresh (from cookie expiry, or default 50 min)."""
@@ -368,11 +469,11 @@ class TwoGisAuthClient:
                 expiry = _parse_expiry_from_set_cookies(resp.headers)
                 if expiry is not None:
                     self._next_refresh_in_seconds = int(expiry * 0.8)
-                    logger.debug(f"Next refresh in {self._next_refresh_in_seconds}s (from cookie expiry)")
+                    logger.debug("Next refresh in %ss (from cookie expiry)", self._next_refresh_in_seconds)
 
                 return self.access_token
         except Exception as e:
-            logger.error(f"Auth refresh failed: {e}")
+            logger.error("Auth refresh failed: %s", e)
             return None
 
 
@@ -382,16 +483,27 @@ class TwoGISWebSocketClient:
     def __init__(
         self,
         ws_url: str,
+        session: aiohttp.ClientSession,
         traccar_client: TraccarClient,
         webhook_client: Optional[WebhookClient] = None,
         auth_client: Optional[TwoGisAuthClient] = None,
     ):
         self.base_ws_url = ws_url
+        self.session = session
         self.traccar_client = traccar_client
         self.webhook_client = webhook_client
         self.auth_client = auth_client
-        self.websocket = None
+        self.websocket: Optional[aiohttp.ClientWebSocketResponse] = None
         self.running = False
+        # friendState messages received in the current session, used to tell a healthy session from a kick
+        self.friend_states_received = 0
+        # Positions waiting to be POSTed to Traccar, drained by background workers
+        self.pos_queue: asyncio.Queue = asyncio.Queue(maxsize=POSITION_QUEUE_SIZE)
+        # Last forwarded state per friend and when it was sent, used to drop repeated updates
+        self._last_state: Dict[str, Tuple[tuple, float]] = {}
+        # In-flight webhook sends (kept referenced so they are not garbage collected)
+        self._pending: Set[asyncio.Task] = set()
+        self._workers: List[asyncio.Task] = []
 
     def _get_ws_url(self) -> Optional[str]:
         """Get WebSocket URL. When using auth, injects access token from refresh. Returns None if no token."""
@@ -414,31 +526,39 @@ class TwoGISWebSocketClient:
             logger.error("No WebSocket URL (missing access token)")
             return False
         try:
-            self.websocket = await websockets.connect(ws_url)
+            self.websocket = await self.session.ws_connect(ws_url, max_msg_size=0, heartbeat=30)
             logger.info("Connected to 2GIS WebSocket")
             return True
         except Exception as e:
-            logger.error(f"Failed to connect to 2GIS WebSocket: {e}")
+            logger.error("Failed to connect to 2GIS WebSocket: %s", e)
             return False
     
-    async def handle_message(self, message: str):
+    async def handle_message(self, message: Union[str, bytes]):
         """Handle incoming WebSocket message"""
         try:
-            data = json.loads(message)
+            # Only friendState frames are used, so skip materializing other channels' messages
+            marker = _FRIEND_STATE_MARKER if isinstance(message, str) else _FRIEND_STATE_MARKER_BYTES
+            if marker not in message and not logger.isEnabledFor(logging.DEBUG):
+                return
+            data = orjson.loads(message)
             
             # Check if this is a friendState message with location data
             if data.get("type") == "friendState":
+                self.friend_states_received += 1
                 payload = data.get("payload", {})
                 friend_id = payload.get("id")
                 location = payload.get("location")
-                battery = payload.get("battery", {})
-                movement = payload.get("movement", {})
-
-                # Send raw data to webhook immediately after parsing
-                if self.webhook_client:
-                    webhook_success = await self.webhook_client.send_data(data)
-                    if not webhook_success:
-                        logger.warning("Failed to send data to webhook")
+                battery = payload.get("battery") or {}
+                movement = payload.get("movement") or {}
+
+                # Send raw data to webhook immediately after parsing, without waiting for the response
+                if self.webhook_client is not None:
+                    if len(self._pending) >= WEBHOOK_MAX_IN_FLIGHT:
+                        logger.warning("Too many webhook sends in flight, dropping webhook data for %s", friend_id)
+                    else:
+                        task = asyncio.create_task(self._send_to_webhook(data))
+                        self._pending.add(task)
+                        task.add_done_callback(self._pending.discard)
                 
                 if friend_id and location and isinstance(location, dict) and "lat" in location and "lon" in location:
                     # Use 2GIS friend ID as device ID
@@ -456,74 +576,108 @@ class TwoGISWebSocketClient:
                     movement_status = movement.get("status")
                     is_moving = movement_status != "stopped" if movement_status is not None else None
                     
-                    # Convert speed from m/s to km/h if provided
-                    if speed is not None:
-                        speed = speed * 3.6
-                    
-                    # Prepare extras with additional 2GIS data not present in main structure
-                    extras = {}
-                    
-                    # Add additional 2GIS payload fields not in main structure
-                    if "lastSeen" in payload and payload["lastSeen"] is not None:
-                        # Convert timestamp to ISO format
-                        last_seen_dt = datetime.fromtimestamp(payload["lastSeen"] / 1000)
-                        extras["2gis_lastSeen"] = last_seen_dt.isoformat() + "Z"
+                    # Skip unchanged states (e.g. a stationary phone), but still send a heartbeat periodically
+                    state_key = _state_key(lat, lon, movement_status, battery_level, is_charging)
+                    now = time.monotonic()
+                    last = self._last_state.get(device_id)
+                    if last is not None and last[0] == state_key and now - last[1] < CONFIG.position_heartbeat_interval:
+                        logger.debug("Unchanged state for %s, skipping Traccar update", device_id)
+                        return
                     
-                    if "locationPlace" in payload:
-                        location_place = payload["locationPlace"]
-                        # Add flattened location place data
-                        if location_place and isinstance(location_place, dict):
-                            if "object" in location_place and location_place["object"] and isinstance(location_place["object"], dict) and "id" in location_place["object"]:
-                                location_id = location_place["object"]["id"]
-                                extras["2gis_locationId"] = location_id
-                                extras["2gis_locationUrl"] = f"https://2gis.kz/almaty/firm/{location_id}"
-                            if "object" in location_place and location_place["object"] and isinstance(location_place["object"], dict) and "regionId" in location_place["object"]:
-                                extras["2gis_regionId"] = location_place["object"]["regionId"]
-                            if "status" in location_place:
-                                extras["2gis_locationStatus"] = location_place["status"]
+                    # Additional 2GIS data not present in main structure
+                    extras = _build_extras(payload, movement)
                     
-                    # Add stoppedAt timestamp if available in movement data
-                    if movement and "stoppedAt" in movement and movement["stoppedAt"] is not None:
-                        stopped_at_dt = datetime.fromtimestamp(movement["stoppedAt"] / 1000)
-                        extras["2gis_stoppedAt"] = stopped_at_dt.isoformat() + "Z"
-                    
-                    # Send to Traccar
-                    success = await self.traccar_client.send_position(
-                        device_id=device_id,
-                        lat=lat,
-                        lon=lon,
-                        speed=speed,
-                        course=course,
-                        accuracy=accuracy,
-                        battery=battery_level,
-                        is_charging=is_charging,
-                        is_moving=is_moving,
-                        movement_status=movement_status,
-                        extras=extras
-                    )
-                    
-                    if success:
-                        charging_status = "charging" if is_charging else "not charging" if is_charging is not None else "unknown"
-                        movement_status = "moving" if is_moving else "stopped" if is_moving is not None else "unknown"
-                        speed_info = f"speed: {speed:.1f} km/h" if speed is not None else "speed: unknown"
-                        logger.info(f"Processed location for {device_id}: {lat}, {lon} (battery: {battery_level}, {charging_status}, {movement_status}, {speed_info})")
+                    # Queue for Traccar; send workers POST it without blocking the read loop
+                    try:
+                        self.pos_queue.put_nowait(Position(
+                            device_id, lat, lon, speed, course, accuracy,
+                            battery_level, is_charging, is_moving, movement_status, extras
+                        ))
+                    except asyncio.QueueFull:
+                        logger.warning("Position queue full, dropping location for %s: %s, %s", device_id, lat, lon)
                     else:
-                        logger.warning(f"Failed to send location for {device_id}: {lat}, {lon}")
+                        # Dropped positions are not recorded; failed sends are forgotten by the worker (_forget_state)
+                        self._last_state[device_id] = (state_key, now)
                 else:
                     logger.debug("Message received but no valid location data or friend ID")
             else:
-                logger.debug(f"Received message type: {data.get('type', 'unknown')}")
+                logger.debug("Received message type: %s", data.get('type', 'unknown'))
                 
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse JSON message: {e}")
+        except orjson.JSONDecodeError as e:
+            logger.error("Failed to parse JSON message: %s", e)
         except Exception as e:
-            logger.error(f"Error handling message: {e}")
+            logger.error("Error handling message: %s", e)
     
+    async def _send_to_webhook(self, data: Dict[str, Any]):
+        """Send raw message data to the webhook (run as a background task)."""
+        if not await self.webhook_client.send_data(data):
+            logger.warning("Failed to send data to webhook")
+
+    async def _send_worker(self):
+        """Background task that drains the position queue and sends each position to Traccar."""
+        while True:
+            position = await self.pos_queue.get()
+            try:
+                success = await self.traccar_client.send_position(position)
+                if not success:
+                    self._forget_state(position)
+                    logger.warning("Failed to send location for %s: %s, %s",
+                                   position.device_id, position.lat, position.lon)
+                elif logger.isEnabledFor(logging.INFO):
+                    is_charging = position.is_charging
+                    is_moving = position.is_moving
+                    speed = position.speed
+                    charging_status = "charging" if is_charging else "not charging" if is_charging is not None else "unknown"
+                    movement_status = "moving" if is_moving else "stopped" if is_moving is not None else "unknown"
+                    speed_info = f"speed: {speed * 3.6:.1f} km/h" if speed is not None else "speed: unknown"
+                    logger.info("Processed location for %s: %s, %s (battery: %s, %s, %s, %s)",
+                                position.device_id, position.lat, position.lon, position.battery,
+                                charging_status, movement_status, speed_info)
+            except asyncio.CancelledError:
+                logger.warning("Send cancelled, location for %s not delivered: %s, %s",
+                               position.device_id, position.lat, position.lon)
+                raise
+            except Exception as e:
+                self._forget_state(position)
+                logger.error("Error in send worker: %s", e)
+            finally:
+                self.pos_queue.task_done()
+
+    def _forget_state(self, position: Position):
+        """Drop the dedup entry for a position Traccar did not accept, so the next identical update is sent."""
+        last = self._last_state.get(position.device_id)
+        if last is not None and last[0] == _state_key(position.lat, position.lon, position.movement_status,
+                                                      position.battery, position.is_charging):
+            del self._last_state[position.device_id]
+
+    def start(self):
+        """Start the Traccar send workers. They run for the bridge's lifetime, independent of WebSocket reconnects."""
+        self._workers = [asyncio.create_task(self._send_worker()) for _ in range(SEND_WORKER_COUNT)]
+
+    async def close(self, timeout: float = SHUTDOWN_DRAIN_TIMEOUT):
+        """Wait up to timeout seconds for queued positions and webhook sends to finish, then cancel the rest."""
+        try:
+            await asyncio.wait_for(self.pos_queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Shutting down with %s positions not sent to Traccar", self.pos_queue.qsize())
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        if self._pending:
+            _, unfinished = await asyncio.wait(set(self._pending), timeout=timeout)
+            if unfinished:
+                logger.warning("Shutting down with %s webhook sends not finished", len(unfinished))
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+
     async def _periodic_refresh_task(self):
         """Background task to refresh token periodically (interval from cookie Max-Age/Expires)."""
         while self.running and self.auth_client:
             delay = self.auth_client.get_next_refresh_seconds()
-            logger.debug(f"Next token refresh in {delay}s")
+            logger.debug("Next token refresh in %ss", delay)
             await asyncio.sleep(delay)
             if not self.running:
                 break
@@ -531,12 +685,18 @@ class TwoGISWebSocketClient:
             if new_token:
                 logger.info("Periodic token refresh completed")
 
-    async def run(self):
-        """Main run loop"""
+    async def run(self) -> bool:
+        """
+        Main run loop. Returns True if the session was healthy: it stayed up for at least RECONNECT_DELAY
+        seconds or received a friendState. Returns False if the connection failed or was dropped straight away
+        (e.g. a rejected token), so the caller keeps backing off.
+        """
         if not await self.connect():
-            return
+            return False
 
         self.running = True
+        self.friend_states_received = 0
+        connected_at = time.monotonic()
         logger.info("Starting 2GIS to Traccar bridge...")
 
         refresh_task = None
@@ -547,14 +707,19 @@ class TwoGISWebSocketClient:
             async for message in self.websocket:
                 if not self.running:
                     break
-                await self.handle_message(message)
+                if message.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                    # Raw str/bytes frame data goes straight to orjson
+                    await self.handle_message(message.data)
+                elif message.type == aiohttp.WSMsgType.ERROR:
+                    logger.error("WebSocket error: %s", self.websocket.exception())
+                    break
+            else:
+                logger.warning("WebSocket connection closed")
 
-        except ConnectionClosed:
-            logger.warning("WebSocket connection closed")
-        except WebSocketException as e:
-            logger.error(f"WebSocket error: {e}")
+        except aiohttp.ClientError as e:
+            logger.error("WebSocket error: %s", e)
         except Exception as e:
-            logger.error(f"Unexpected error: {e}")
+            logger.error("Unexpected error: %s", e)
         finally:
             self.running = False
             if refresh_task:
@@ -564,33 +729,24 @@ class TwoGISWebSocketClient:
                 except asyncio.CancelledError:
                     pass
             await self.disconnect()
+        return self.friend_states_received > 0 or time.monotonic() - connected_at >= CONFIG.reconnect_delay
     
     async def disconnect(self):
         """Disconnect from WebSocket"""
         self.running = False
-        if self.websocket:
+        if self.websocket and not self.websocket.closed:
             await self.websocket.close()
             logger.info("Disconnected from 2GIS WebSocket")
 
 
-@asynccontextmanager
-async def _optional_auth_context(auth_client: Optional[TwoGisAuthClient]):
-    """Async context manager that enters auth_client if present, else yields None."""
-    if auth_client is None:
-        yield None
-    else:
-        async with auth_client:
-            yield auth_client
-
-
 def _create_auth_client() -> Optional[TwoGisAuthClient]:
     """Create TwoGisAuthClient if refresh token is configured. Access token comes from refresh only."""
-    if not TWOGIS_REFRESH_TOKEN:
+    if not CONFIG.twogis_refresh_token:
         return None
     auth = TwoGisAuthClient(
-        refresh_url=TWOGIS_AUTH_REFRESH_URL,
-        refresh_token=TWOGIS_REFRESH_TOKEN,
-        token_file=TWOGIS_TOKEN_FILE,
+        refresh_url=CONFIG.twogis_auth_refresh_url,
+        refresh_token=CONFIG.twogis_refresh_token,
+        token_file=CONFIG.twogis_token_file,
     )
     auth._load_tokens_from_file()
     if auth.access_token:
@@ -598,50 +754,104 @@ def _create_auth_client() -> Optional[TwoGisAuthClient]:
     return auth
 
 
+def _create_http2_client() -> Optional["httpx.AsyncClient"]:
+    """Create an HTTP/2-capable httpx.AsyncClient for Traccar if TRACCAR_HTTP2 is enabled."""
+    if not CONFIG.traccar_http2:
+        return None
+    try:
+        import httpx  # Optional dependency, only needed with TRACCAR_HTTP2
+    except ImportError:
+        logger.error("TRACCAR_HTTP2 is enabled but httpx is not installed (pip install -r requirements-http2.txt)")
+        raise
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=32),
+        timeout=10,
+    )
+
+
+async def _run_with_reconnect(client: TwoGISWebSocketClient):
+    """
+    Run the client forever, reconnecting with exponential backoff and jitter.
+    The delay starts at RECONNECT_INITIAL_DELAY, doubles up to RECONNECT_DELAY and resets only after a
+    healthy session (see TwoGISWebSocketClient.run), so accept-then-close servers are backed off too.
+    Exits with status 1 after MAX_RECONNECT_ATTEMPTS consecutive failed sessions (0 = never).
+    """
+    backoff = RECONNECT_INITIAL_DELAY
+    failures = 0
+    while True:
+        try:
+            healthy = await client.run()
+        except Exception as e:
+            logger.error("Error in main loop: %s", e)
+            healthy = False
+
+        if healthy:
+            backoff = RECONNECT_INITIAL_DELAY
+            failures = 0
+        else:
+            failures += 1
+            if CONFIG.max_reconnect_attempts and failures >= CONFIG.max_reconnect_attempts:
+                logger.error("Giving up after %s failed connection attempts", failures)
+                raise SystemExit(1)
+
+        delay = backoff + random.uniform(0, backoff * 0.1)
+        logger.info("Reconnecting in %.1f seconds...", delay)
+        await asyncio.sleep(delay)
+        backoff = min(backoff * 2, CONFIG.reconnect_delay)
+
+
 async def main():
     """Main function"""
     logger.info("Starting 2GIS to Traccar bridge...")
 
-    # Initialize webhook client if configured
-    webhook_client = None
-    if WEBHOOK_URL and WEBHOOK_TOKEN:
-        webhook_client = WebhookClient(WEBHOOK_URL, WEBHOOK_TOKEN, WEBHOOK_TABLE_NAME)
-        logger.info(f"Webhook configured: {WEBHOOK_URL} (table: {WEBHOOK_TABLE_NAME})")
-    else:
-        logger.info("Webhook not configured, skipping webhook functionality")
-
-    auth_client = _create_auth_client()
-    if auth_client:
-        logger.info("Token refresh enabled")
-
-    # Initialize Traccar client (no authentication needed with OsmAnd protocol)
-    async with TraccarClient(TRACCAR_BASE_URL) as traccar_client:
-        async with _optional_auth_context(auth_client) as auth:
-            if webhook_client:
-                async with webhook_client:
-                    client = TwoGISWebSocketClient(TWOGIS_WS_URL, traccar_client, webhook_client, auth)
-                    while True:
-                        try:
-                            await client.run()
-                        except Exception as e:
-                            logger.error(f"Error in main loop: {e}")
-                            logger.info("Retrying in 30 seconds...")
-                            await asyncio.sleep(30)
-            else:
-                client = TwoGISWebSocketClient(TWOGIS_WS_URL, traccar_client, auth_client=auth)
-                while True:
-                    try:
-                        await client.run()
-                    except Exception as e:
-                        logger.error(f"Error in main loop: {e}")
-                        logger.info("Retrying in 30 seconds...")
-                        await asyncio.sleep(30)
+    async with AsyncExitStack() as stack:
+        # One pooled session for the 2GIS WebSocket and Traccar/webhook POSTs keeps connections alive between messages
+        connector = aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=32,
+            keepalive_timeout=75,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True,
+        )
+        session = await stack.enter_async_context(aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=10),
+        ))
+
+        # Initialize webhook client if configured
+        webhook_client = None
+        if CONFIG.webhook_url and CONFIG.webhook_token:
+            webhook_client = WebhookClient(CONFIG.webhook_url, CONFIG.webhook_token, CONFIG.webhook_table_name, session)
+            logger.info("Webhook configured: %s (table: %s)", CONFIG.webhook_url, CONFIG.webhook_table_name)
+        else:
+            logger.info("Webhook not configured, skipping webhook functionality")
+
+        auth_client = _create_auth_client()
+        if auth_client:
+            await stack.enter_async_context(auth_client)
+            logger.info("Token refresh enabled")
+
+        http2_client = _create_http2_client()
+        if http2_client:
+            await stack.enter_async_context(http2_client)
+            logger.info("HTTP/2 enabled for Traccar")
+
+        # Initialize Traccar client (no authentication needed with OsmAnd protocol)
+        traccar_client = TraccarClient(CONFIG.traccar_base_url, session, http2_client)
+        client = TwoGISWebSocketClient(CONFIG.twogis_ws_url, session, traccar_client, webhook_client, auth_client)
+        client.start()
+        stack.push_async_callback(client.close)
+        await _run_with_reconnect(client)
 
 
 if __name__ == "__main__":
+    if uvloop is not None:
+        uvloop.install()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Shutting down...")
     except Exception as e:
-        logger.error(f"Fatal error: {e}")
+        logger.error("Fatal error: %s", e)
+        raise SystemExit(1)
@@ -6,52 +6,84 @@ Copy env.example to .env and update the values.
 
 import os
 import sys
-from dotenv import load_dotenv
+from dataclasses import dataclass
+from typing import Optional
 
-# Load environment variables from .env file
-load_dotenv()
+# Load environment variables from .env file (containers already get them from docker-compose; set USE_DOTENV=0)
+if os.getenv("USE_DOTENV", "1") == "1":
+    from dotenv import load_dotenv
+    load_dotenv()
 
-def validate_required_env(env_var, description):
-    """Validate that a required environment variable is set"""
-    value = os.getenv(env_var)
-    if not value:
-        print(f"❌ Error: Required environment variable {env_var} is not set.")
-        print(f"   {description}")
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Bridge settings, resolved once from the environment at import time"""
+
+    # 2GIS WebSocket Configuration (base URL without token - token injected from refresh)
+    twogis_ws_url: str
+    # 2GIS Auth Refresh (required - access token from refresh, interval from cookie expiry)
+    twogis_refresh_token: str
+    twogis_auth_refresh_url: str
+    twogis_token_file: str
+
+    # Traccar Server Configuration
+    # Use OsmAnd protocol - no authentication needed!
+    # Format: http://your-traccar-server:5055 (default Traccar port is 8082, but OsmAnd uses 5055)
+    traccar_base_url: str
+    # Send positions over HTTP/2 via httpx (only negotiated with https:// Traccar URLs)
+    traccar_http2: bool
+
+    # Logging Configuration
+    log_level: str
+    log_file: str
+
+    # Reconnection settings (exponential backoff)
+    reconnect_delay: int  # maximum delay between attempts, seconds
+    max_reconnect_attempts: int  # consecutive failed or dropped sessions before giving up, 0 = retry forever
+
+    # Unchanged positions are not re-sent to Traccar more often than this
+    position_heartbeat_interval: int  # seconds
+
+    # Webhook Configuration (optional)
+    webhook_url: Optional[str]
+    webhook_token: Optional[str]
+    webhook_table_name: str
+
+
+# Required environment variables and the hint shown when one is missing
+REQUIRED_ENV = {
+    "TWOGIS_WS_URL": "2GIS WebSocket base URL (no token - injected from refresh)",
+    "TWOGIS_REFRESH_TOKEN": "2GIS refresh token (dg5_auth_refresh_token from browser cookies)",
+    "TRACCAR_BASE_URL": "Traccar server URL with OsmAnd port (usually 5055)",
+}
+
+
+def load_config() -> Config:
+    """Build Config from the environment, exiting with a helpful message if a required variable is missing"""
+    env = os.environ
+    missing = next((name for name in REQUIRED_ENV if not env.get(name)), None)
+    if missing:
+        print(f"❌ Error: Required environment variable {missing} is not set.")
+        print(f"   {REQUIRED_ENV[missing]}")
         print(f"   Please copy env.example to .env and update the values.")
         sys.exit(1)
-    return value
-
-# 2GIS WebSocket Configuration (base URL without token - token injected from refresh)
-TWOGIS_WS_URL = validate_required_env(
-    "TWOGIS_WS_URL",
-    "2GIS WebSocket base URL (no token - injected from refresh)"
-)
-
-# 2GIS Auth Refresh (required - access token from refresh, interval from cookie expiry)
-TWOGIS_REFRESH_TOKEN = validate_required_env(
-    "TWOGIS_REFRESH_TOKEN",
-    "2GIS refresh token (dg5_auth_refresh_token from browser cookies)"
-)
-TWOGIS_AUTH_REFRESH_URL = os.getenv("TWOGIS_AUTH_REFRESH_URL", "https://2gis.kz/_/auth/refresh")
-TWOGIS_TOKEN_FILE = os.getenv("TWOGIS_TOKEN_FILE", ".2gis_tokens.json")
-
-# Traccar Server Configuration
-# Use OsmAnd protocol - no authentication needed!
-# Format: http://your-traccar-server:5055 (default Traccar port is 8082, but OsmAnd uses 5055)
-TRACCAR_BASE_URL = validate_required_env(
-    "TRACCAR_BASE_URL", 
-    "Traccar server URL with OsmAnd port (usually 5055)"
-)
-
-# Logging Configuration
-LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
-LOG_FILE = os.getenv("LOG_FILE", "2gis2traccar.log")
-
-# Reconnection settings
-RECONNECT_DELAY = int(os.getenv("RECONNECT_DELAY", "30"))  # seconds
-MAX_RECONNECT_ATTEMPTS = int(os.getenv("MAX_RECONNECT_ATTEMPTS", "10"))
-
-# Webhook Configuration (optional)
-WEBHOOK_URL = os.getenv("WEBHOOK_URL")
-WEBHOOK_TOKEN = os.getenv("WEBHOOK_TOKEN")
-WEBHOOK_TABLE_NAME = os.getenv("WEBHOOK_TABLE_NAME", "2gis_locations")
+
+    return Config(
+        twogis_ws_url=env["TWOGIS_WS_URL"],
+        twogis_refresh_token=env["TWOGIS_REFRESH_TOKEN"],
+        twogis_auth_refresh_url=env.get("TWOGIS_AUTH_REFRESH_URL", "https://2gis.kz/_/auth/refresh"),
+        twogis_token_file=env.get("TWOGIS_TOKEN_FILE", ".2gis_tokens.json"),
+        traccar_base_url=env["TRACCAR_BASE_URL"],
+        traccar_http2=env.get("TRACCAR_HTTP2", "false").lower() in ("1", "true", "yes"),
+        log_level=env.get("LOG_LEVEL", "INFO"),
+        log_file=env.get("LOG_FILE", "2gis2traccar.log"),
+        reconnect_delay=int(env.get("RECONNECT_DELAY", "30")),
+        max_reconnect_attempts=int(env.get("MAX_RECONNECT_ATTEMPTS", "10")),
+        position_heartbeat_interval=int(env.get("POSITION_HEARTBEAT_INTERVAL", "300")),
+        webhook_url=env.get("WEBHOOK_URL") or None,
+        webhook_token=env.get("WEBHOOK_TOKEN") or None,
+        webhook_table_name=env.get("WEBHOOK_TABLE_NAME", "2gis_locations"),
+    )
+
+
+CONFIG = load_config()